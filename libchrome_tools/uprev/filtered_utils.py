@@ -4,8 +4,8 @@
 """ Provides utilities for filtered branch handling. """
 
 import collections
+import functools
 import re
-import subprocess
 
 import utils
 
@@ -29,6 +29,9 @@ GitCommitAuthorship = collections.namedtuple(
 )
 
 
+# Commits are immutable, and process_commits reads the same filtered commit
+# again for every browser commit that maps to it.
+@functools.lru_cache(maxsize=1024)
 def get_metadata(commit_hash):
   """Returns the metadata of the commit specified by the commit_hash.
 
@@ -38,13 +41,18 @@ def get_metadata(commit_hash):
   omitted.
   Returns metadata from the commit message about commit_hash on the filtered
   branch.
+  Results are cached and shared between callers, so they must not be modified.
 
   Args:
       commit_hash: the commit hash on the filtered branch.
   """
 
-  ret = subprocess.check_output(['git', 'cat-file', 'commit',
-                                 commit_hash]).split(b'\n')
+  if type(commit_hash) == str:
+      commit_hash = commit_hash.encode('ascii')
+  # ^{commit} peels tags, as `git cat-file commit` does.
+  objecttype, content = utils.git_cat_file(commit_hash + b'^{commit}')
+  assert objecttype == b'commit', (commit_hash, objecttype)
+  ret = content.split(b'\n')
   parents = []
   tree_hash = None
   authorship = None
@@ -4,12 +4,16 @@
 
 """Provide filters for libchrome tools."""
 
+import functools
 import re
 
+# All patterns are applied with re.match: they are anchored at the start of the
+# path and only need to match a prefix of it, so no trailing '.*' is needed.
+
 # Libchrome wants WANT but not WANT_EXCLUDE
 # aka files matching WANT will be copied from upstream_files
 WANT = [
-    re.compile(rb'base/((?!(allocator|third_party)/).*$)'),
+    re.compile(rb'base/(?!(allocator|third_party)/)'),
     re.compile(
         rb'base/allocator/(allocator_shim.cc|allocator_shim_override_linker_wrapped_symbols.h|allocator_shim_override_cpp_symbols.h|allocator_shim_override_libc_symbols.h|allocator_shim_default_dispatch_to_glibc.cc|allocator_shim.h|allocator_shim_default_dispatch_to_linker_wrapped_symbols.cc|allocator_extension.cc|allocator_extension.h|allocator_shim_internals.h)$'
     ),
@@ -33,17 +37,31 @@ WANT = [
 ]
 
 # WANT_EXCLUDE will be excluded from WANT
-WANT_EXCLUDE = [
-    re.compile(rb'(.*/)?BUILD.gn$'),
-    re.compile(rb'(.*/)?PRESUBMIT.py$'),
-    re.compile(rb'(.*/)?OWNERS$'),
-    re.compile(rb'(.*/)?SECURITY_OWNERS$'),
-    re.compile(rb'(.*/)?DEPS$'),
-    re.compile(rb'base/(.*/)?(ios|win|fuchsia|mac|openbsd|freebsd|nacl)/.*'),
-    re.compile(rb'.*_(ios|win|mac|fuchsia|openbsd|freebsd|nacl)[_./]'),
-    re.compile(rb'.*/(ios|win|mac|fuchsia|openbsd|freebsd|nacl)_'),
-    re.compile(rb'dbus/(test_serv(er|ice)\.cc|test_service\.h)$')
+# Each rule is paired with literals, at least one of which appears in every
+# path the rule matches. Paths containing none of the literals of any rule skip
+# the WANT_EXCLUDE regex entirely.
+_PLATFORMS = [
+    b'ios', b'win', b'fuchsia', b'mac', b'openbsd', b'freebsd', b'nacl',
+]
+_WANT_EXCLUDE_RULES = [
+    (re.compile(rb'(.*/)?BUILD.gn$'), [b'BUILD']),
+    (re.compile(rb'(.*/)?PRESUBMIT.py$'), [b'PRESUBMIT']),
+    (re.compile(rb'(.*/)?OWNERS$'), [b'OWNERS']),
+    (re.compile(rb'(.*/)?SECURITY_OWNERS$'), [b'SECURITY_OWNERS']),
+    (re.compile(rb'(.*/)?DEPS$'), [b'DEPS']),
+    (re.compile(rb'base/(.*/)?(ios|win|fuchsia|mac|openbsd|freebsd|nacl)/'),
+     _PLATFORMS),
+    (re.compile(rb'.*_(ios|win|mac|fuchsia|openbsd|freebsd|nacl)[_./]'),
+     _PLATFORMS),
+    (re.compile(rb'.*/(ios|win|mac|fuchsia|openbsd|freebsd|nacl)_'),
+     _PLATFORMS),
+    (re.compile(rb'dbus/(test_serv(er|ice)\.cc|test_service\.h)$'),
+     [b'test_serv']),
 ]
+for _regex, _hints in _WANT_EXCLUDE_RULES:
+    # Catches a missing or mistyped literal when a rule is added or changed.
+    assert all(hint in _regex.pattern for hint in _hints), _regex.pattern
+WANT_EXCLUDE = [regex for regex, _ in _WANT_EXCLUDE_RULES]
 
 # Files matching KEEP should not be touched.
 # aka files matching KEEP will keep its our_files version,
@@ -51,7 +69,7 @@ WANT_EXCLUDE = [
 # KEEP-KEEP_EXCLUDE must NOT intersect with WANT-WANT_EXCLUDE
 KEEP = [
     re.compile(
-        b'(Android.bp|BUILD.gn|crypto|libchrome_tools|MODULE_LICENSE_BSD|NOTICE|OWNERS|PRESUBMIT.cfg|soong|testrunner.cc|third_party)(/.*)?$'
+        b'(Android.bp|BUILD.gn|crypto|libchrome_tools|MODULE_LICENSE_BSD|NOTICE|OWNERS|PRESUBMIT.cfg|soong|testrunner.cc|third_party)(/|$)'
     ),
     re.compile(rb'[^/]*$'),
     re.compile(rb'.*buildflags.h'),
@@ -66,32 +84,44 @@ KEEP_EXCLUDE = [
 ]
 
 
+def _combine(regexes):
+    """Returns a regex matching a path if any of regexes matches it."""
+    return re.compile(b'|'.join(b'(?:%s)' % regex.pattern for regex in regexes))
+
+
+# Each list above folded into a single alternation, so a path is scanned once
+# per list instead of once per pattern.
+_WANT_RE = _combine(WANT)
+_WANT_EXCLUDE_RE = _combine(WANT_EXCLUDE)
+_KEEP_RE = _combine(KEEP)
+_KEEP_EXCLUDE_RE = _combine(KEEP_EXCLUDE)
+
+# A path containing none of the WANT_EXCLUDE literals cannot be excluded.
+# Searching for plain literals is much cheaper than matching WANT_EXCLUDE, and
+# rules out nearly every path.
+_WANT_EXCLUDE_HINTS_RE = re.compile(b'|'.join(
+    re.escape(hint) for hint in sorted(
+        set(hint for _, hints in _WANT_EXCLUDE_RULES for hint in hints))))
+
+
+# Filtering a history visits the same paths over and over, so results for the
+# most recently seen paths are memoized.
+_FILTER_CACHE_SIZE = 16384
+
+
+@functools.lru_cache(maxsize=_FILTER_CACHE_SIZE)
 def _want_file(path):
     """Returns whether the path wants to be a new file."""
-    wanted = False
-    for want_file_regex in WANT:
-        if want_file_regex.match(path):
-            wanted = True
-            break
-    for exclude_file_regex in WANT_EXCLUDE:
-        if exclude_file_regex.match(path):
-            wanted = False
-            break
-    return wanted
+    if not _WANT_RE.match(path):
+        return False
+    return not (_WANT_EXCLUDE_HINTS_RE.search(path) and
+                _WANT_EXCLUDE_RE.match(path))
 
 
+@functools.lru_cache(maxsize=_FILTER_CACHE_SIZE)
 def _keep_file(path):
     """Returns whether the path wants to be kept untouched in local files."""
-    keep = False
-    for keep_file_regex in KEEP:
-        if keep_file_regex.match(path):
-            keep = True
-            break
-    for exclude_file_regex in KEEP_EXCLUDE:
-        if exclude_file_regex.match(path):
-            keep = False
-            break
-    return keep
+    return bool(_KEEP_RE.match(path)) and not _KEEP_EXCLUDE_RE.match(path)
 
 
 def filter_file(our_files, upstream_files):
@@ -5,7 +5,9 @@
 
 import argparse
 import collections
+import concurrent.futures
 import datetime
+import itertools
 import os
 import subprocess
 import sys
@@ -16,30 +18,48 @@ import filters
 import lazytree
 import utils
 
-# Use avg speed of last TIMING_DISTANCE commits.
+# Average speed over roughly the last _TIMING_DISTANCE commits.
 _TIMING_DISTANCE = 100
 # Verify the tree is consistent (diff-based, and actual) when a commit is made
 # after every _VERIFY_INTEGRITY_DISTANCE in browser repository.
 # Merge commits are always verified.
 _VERIFY_INTEGRITY_DISTANCE = 1000
+# Number of pending commits whose metadata and diff are read ahead, by
+# _PREFETCH_WORKERS threads, while earlier commits are being committed.
+_PREFETCH_DISTANCE = 64
+_PREFETCH_WORKERS = 8
+# Put between the original message and the original commit hash, in the
+# message of every commit made on the filtered branch.
+_ORIGINAL_COMMIT_PREFIX = (
+    b'\n\n' + filtered_utils.CROS_LIBCHROME_ORIGINAL_COMMIT + b': ')
 
 
-def timing(timing_deque, update=True):
-    """Returns a speed (c/s), and updates timing_deque.
+class Timing:
+    """Tracks the speed (c/s) as a moving average of time between commits.
 
-    Args:
-        timing_deque: a deque to store the timing of past _TIMING_DISTANCE.
-        update: adds current timestamp to timing_deque if True. It needs to set
-            to False, if it wants to be called multiple times with the current
-            timestamp.
+    The clock starts at the first update, so startup time is not counted, and
+    the first _TIMING_DISTANCE intervals are averaged evenly.
     """
-    first = timing_deque[0]
-    now = time.time()
-    if update:
-        timing_deque.append(now)
-        if len(timing_deque) > _TIMING_DISTANCE:
-            timing_deque.popleft()
-    return _TIMING_DISTANCE / (now - first)
+
+    def __init__(self):
+        self._last = None
+        self._count = 0
+        self._interval = 0.0 # average seconds per commit
+
+    def speed(self):
+        """Returns the current speed (c/s)."""
+        if not self._interval:
+            return float('inf')
+        return 1 / self._interval
+
+    def update(self):
+        """Records a commit done now, and returns the updated speed (c/s)."""
+        now = time.monotonic()
+        if self._last is not None:
+            self._count = min(self._count + 1, _TIMING_DISTANCE)
+            self._interval += (now - self._last - self._interval) / self._count
+        self._last = now
+        return self.speed()
 
 
 def get_start_commit_of_browser_tree(parent_filtered):
@@ -101,9 +121,7 @@ def do_commit(treehash, commithash, meta, commits_map):
     for parent in meta.parents:
         parents_parameters.append('-p')
         parents_parameters.append(find_filtered_commit(parent, commits_map))
-    msg = (meta.message + b'\n\n' +
-           filtered_utils.CROS_LIBCHROME_ORIGINAL_COMMIT +
-           b': ' + commithash + b'\n')
+    msg = b''.join([meta.message, _ORIGINAL_COMMIT_PREFIX, commithash, b'\n'])
     return subprocess.check_output(
         ['git', 'commit-tree'] + parents_parameters + [treehash],
         env=dict(os.environ,
@@ -122,7 +140,24 @@ def verify_commit(original_commit, new_tree):
         new_tree: tree hash created for upstream branch commit.
     """
     expected_file_list = filters.filter_file([], utils.get_file_list(original_commit))
-    assert utils.git_mktree(expected_file_list) == new_tree
+    # Both lists come from `git ls-tree -r`, so they are in the same order.
+    # Comparing them avoids writing every expected tree object with mktree.
+    assert expected_file_list == utils.get_file_list(new_tree)
+
+
+def read_commit(commit_hash):
+    """Returns the metadata and the filtered diff with its first parent.
+
+    Only reads from the browser repository, so it is safe to run ahead of
+    process_commits in another thread.
+
+    Args:
+        commit_hash: commit hash in browser repository.
+    """
+    meta = filtered_utils.get_metadata(commit_hash)
+    diff_with_parent = filters.filter_diff(utils.git_difftree(
+        meta.parents[0] if meta.parents else None, commit_hash))
+    return meta, diff_with_parent
 
 
 def process_commits(pending_commits, commits_map, progress_callback, commit_callback):
@@ -141,38 +176,46 @@ def process_commits(pending_commits, commits_map, progress_callback, commit_call
     """
     last_commit = None
     last_verified = -1
-    for i, commit in enumerate(pending_commits, start=1):
-        meta = filtered_utils.get_metadata(commit[0])
-        if progress_callback:
-            progress_callback(i, len(pending_commits), commit[0], meta)
-        diff_with_parent = filters.filter_diff(utils.git_difftree(
-            meta.parents[0] if meta.parents else None, commit[0]))
-        git_lazytree = lazytree.LazyTree(
-            filtered_utils.get_metadata(
-                find_filtered_commit(meta.parents[0], commits_map)).tree
-            if meta.parents else None)
-        if len(meta.parents) <= 1 and len(diff_with_parent) == 0:
-            # not merge commit    AND no diff
-            if len(meta.parents) == 1 and meta.parents[0] in commits_map:
-                commits_map[commit[0]] = commits_map[meta.parents[0]]
-            continue
-        for op, f in diff_with_parent:
-            if op == utils.DiffOperations.ADD or op == utils.DiffOperations.REP:
-                git_lazytree[f.path] = f
-            elif op == utils.DiffOperations.DEL:
-                del git_lazytree[f.path]
-        treehash_after_diff_applied = git_lazytree.hash()
-        filtered_commit = do_commit(treehash_after_diff_applied, commit[0],
-                                    meta, commits_map)
-        if commit_callback:
-            commit_callback(commit[0], filtered_commit, meta)
-        commits_map[commit[0]] = filtered_commit
-        last_commit = filtered_commit
-        if len(meta.parents) > 1 or (i - last_verified >=
-                                     _VERIFY_INTEGRITY_DISTANCE):
-            # merge commit    OR  every _VERIFY_INTEGRITY_DISTANCE
-            last_verified = i
-            verify_commit(commit[0], treehash_after_diff_applied)
+    with concurrent.futures.ThreadPoolExecutor(
+            max_workers=_PREFETCH_WORKERS) as executor:
+        # Futures of read_commit for the next commits, in pending_commits order.
+        prefetched = collections.deque()
+        upcoming = iter(pending_commits)
+        for commit in itertools.islice(upcoming, _PREFETCH_DISTANCE):
+            prefetched.append(executor.submit(read_commit, commit[0]))
+        for i, commit in enumerate(pending_commits, start=1):
+            meta, diff_with_parent = prefetched.popleft().result()
+            next_commit = next(upcoming, None)
+            if next_commit:
+                prefetched.append(executor.submit(read_commit, next_commit[0]))
+            if progress_callback:
+                progress_callback(i, len(pending_commits), commit[0], meta)
+            git_lazytree = lazytree.LazyTree(
+                filtered_utils.get_metadata(
+                    find_filtered_commit(meta.parents[0], commits_map)).tree
+                if meta.parents else None)
+            if len(meta.parents) <= 1 and len(diff_with_parent) == 0:
+                # not merge commit    AND no diff
+                if len(meta.parents) == 1 and meta.parents[0] in commits_map:
+                    commits_map[commit[0]] = commits_map[meta.parents[0]]
+                continue
+            for op, f in diff_with_parent:
+                if op == utils.DiffOperations.ADD or op == utils.DiffOperations.REP:
+                    git_lazytree[f.path] = f
+                elif op == utils.DiffOperations.DEL:
+                    del git_lazytree[f.path]
+            treehash_after_diff_applied = git_lazytree.hash()
+            filtered_commit = do_commit(treehash_after_diff_applied, commit[0],
+                                        meta, commits_map)
+            if commit_callback:
+                commit_callback(commit[0], filtered_commit, meta)
+            commits_map[commit[0]] = filtered_commit
+            last_commit = filtered_commit
+            if len(meta.parents) > 1 or (i - last_verified >=
+                                         _VERIFY_INTEGRITY_DISTANCE):
+                # merge commit    OR  every _VERIFY_INTEGRITY_DISTANCE
+                last_verified = i
+                verify_commit(commit[0], treehash_after_diff_applied)
     # Verify last commit
     verify_commit(pending_commits[-1][0], filtered_utils.get_metadata(last_commit).tree)
     return last_commit
@@ -205,13 +248,13 @@ def main():
     # Get a mapping between browser repository and filtered branch for commits
     # in filtered branch.
     print('reading commits details for commits mapping')
-    timing_deque = collections.deque([time.time()])
+    commits_timing = Timing()
     commits_map = filtered_utils.get_commits_map(
         arg.parent_filtered[0],
         lambda cur_idx, tot_cnt, cur_hash:
         (
             print('Reading', cur_hash, '%d/%d' % (cur_idx, tot_cnt),
-                  '%f c/s' % timing(timing_deque),
+                  '%f c/s' % commits_timing.update(),
                   end='\r', flush=True),
         ))
     if not 'ROOT' in commits_map:
@@ -225,7 +268,7 @@ def main():
     # Process newer commits in browser repository from
     # last_known.original_commits
     print('search for commits to filter')
-    timing_deque= collections.deque([time.time()])
+    commits_timing = Timing()
     pending_commits = utils.git_revlist(
         meta_last_known.original_commits[0] if meta_last_known else None,
         arg.goal_browser[0])
@@ -237,10 +280,10 @@ def main():
         lambda cur_idx, tot_cnt, cur_hash, cur_meta: (
             print('Processing',
                   cur_hash, '%d/%d' % (cur_idx, tot_cnt),
-                  '%f c/s' % timing(timing_deque, update=False),
+                  '%f c/s' % commits_timing.speed(),
                   'eta %s' % (
                       datetime.timedelta(
-                          seconds=int((tot_cnt - cur_idx) / timing(timing_deque)))),
+                          seconds=int((tot_cnt - cur_idx) / commits_timing.update()))),
                   cur_meta.title[:50],
                   end='\r', flush=True),
         ),
@@ -3,13 +3,24 @@
 # Use of this source code is governed by a BSD-style license that can be
 # found in the LICENSE file.
 
-import re
+import collections
+import hashlib
 import subprocess
 
 import utils
 
 
-GIT_LSTREE_RE_LINE = re.compile(rb'^([^ ]*) ([^ ]*) ([^ ]*)\t(.*)$')
+# Mode of subtree entries in raw tree objects.
+GIT_TREE_MODE = b'40000'
+# Mode of submodule entries in raw tree objects.
+GIT_COMMIT_MODE = b'160000'
+
+# Maps the sha1 of `git mktree` input to the tree object id it made, so a
+# directory recreated with identical content, e.g. by a revert or by both sides
+# of a merge, is not written again. Holds the _MKTREE_CACHE_SIZE most recently
+# used entries, since most directory states are never seen twice.
+_MKTREE_CACHE = collections.OrderedDict()
+_MKTREE_CACHE_SIZE = 4096
 
 
 class LazyTree:
@@ -38,20 +49,29 @@ class LazyTree:
         """Loads _treehash into _subtrees and _files."""
         if self._files is not None: # _subtrees is also not None too here.
             return
-        output = subprocess.check_output(['git', 'ls-tree', self._treehash]).split(b'\n')
+        # Read the raw tree object through the shared `git cat-file --batch`
+        # rather than running `git ls-tree` for every directory.
+        objecttype, content = utils.git_cat_file(self._treehash)
+        assert objecttype == b'tree', (self._treehash, objecttype)
+        # Object ids are stored in binary in tree objects.
+        id_size = len(self._treehash) // 2
         self._files = {}
         self._subtrees = {}
-        for line in output:
-            if not line:
-                continue
-            m = GIT_LSTREE_RE_LINE.match(line)
-            mode, gittype, objecthash, name = m.groups()
-            assert gittype == b'blob' or gittype == b'tree'
+        pos = 0
+        while pos < len(content):
+            # Entry looks like
+            # mode<space>name<NUL>object id
+            space = content.index(b' ', pos)
+            nul = content.index(b'\0', space)
+            mode, name = content[pos:space], content[space + 1:nul]
+            pos = nul + 1 + id_size
+            objecthash = content[nul + 1:pos].hex().encode('ascii')
+            assert mode != GIT_COMMIT_MODE
             assert name not in self._files and name not in self._subtrees
-            if gittype == b'blob':
-                self._files[name] = utils.GitFile(None, mode, objecthash)
-            elif gittype == b'tree':
+            if mode == GIT_TREE_MODE:
                 self._subtrees[name] = LazyTree(objecthash)
+            else:
+                self._files[name] = utils.GitFile(None, mode, objecthash)
 
     def _remove(self, components):
         """Removes components from self tree.
@@ -107,6 +127,9 @@ class LazyTree:
     def _set(self, components, f):
         """Adds or replace a file.
 
+        Returns whether the tree changed. Setting a file to the same mode and
+        object id keeps the tree hash, so hash() needs no git mktree for it.
+
         Args:
             components: the path to set, relative to self. Each element means
                 one level of directory tree.
@@ -114,16 +137,22 @@ class LazyTree:
         """
 
         self._loadtree()
-        self._treehash = None
         if len(components) == 1:
+            current = self._files.get(components[0])
+            if current and current.mode == f.mode and current.id == f.id:
+                return False
             self._files[components[0]] = f
-            return
+            self._treehash = None
+            return True
 
         # Add to subdirectory
         dirname, components = components[0], components[1:]
         if dirname not in self._subtrees:
             self._subtrees[dirname] = LazyTree()
-        self._subtrees[dirname]._set(components, f)
+        if not self._subtrees[dirname]._set(components, f):
+            return False
+        self._treehash = None
+        return True
 
     def __setitem__(self, path, f):
         """Adds or replaces a file.
@@ -164,6 +193,15 @@ class LazyTree:
             else:
                 mktree_input.append(
                     b'040000 tree %s\t%s' % (self._subtrees[name].hash(), name))
-        return subprocess.check_output(
-            ['git', 'mktree'],
-            input=b'\n'.join(mktree_input)).strip(b'\n')
+        mktree_input = b'\n'.join(mktree_input)
+        key = hashlib.sha1(mktree_input).digest()
+        treehash = _MKTREE_CACHE.get(key)
+        if treehash is not None:
+            _MKTREE_CACHE.move_to_end(key)
+            return treehash
+        treehash = subprocess.check_output(
+            ['git', 'mktree'], input=mktree_input).strip(b'\n')
+        _MKTREE_CACHE[key] = treehash
+        if len(_MKTREE_CACHE) > _MKTREE_CACHE_SIZE:
+            _MKTREE_CACHE.popitem(last=False)
+        return treehash
@@ -9,6 +9,8 @@ import enum
 import os
 import re
 import subprocess
+import tempfile
+import threading
 
 class DiffOperations(enum.Enum):
     """
@@ -37,6 +39,58 @@ GitBlameLine = collections.namedtuple(
 GIT_DIFFTREE_RE_LINE = re.compile(rb'^:([^ ]*) ([^ ]*) ([^ ]*) ([^ ]*) ([^ ]*)\t(.*)$')
 
 
+class _GitCatFileBatch:
+    """Reads git objects through one long-running `git cat-file --batch`.
+
+    Saves a git process per object read. The process is started on first use,
+    and may be shared between threads.
+    """
+
+    def __init__(self):
+        self._process = None
+        self._lock = threading.Lock()
+
+    def read(self, name):
+        """Returns a tuple of type and content of the object.
+
+        Args:
+            name: object name, e.g. a hash, a ref or <commit>^{tree}.
+        """
+        if type(name) == str:
+            name = name.encode('ascii')
+        with self._lock:
+            if self._process is None:
+                self._process = subprocess.Popen(
+                    ['git', 'cat-file', '--batch'],
+                    stdin=subprocess.PIPE,
+                    stdout=subprocess.PIPE)
+            self._process.stdin.write(name + b'\n')
+            self._process.stdin.flush()
+            # Header looks like
+            # objectname<space>type<space>size
+            # or objectname<space>missing for unknown objects.
+            header = self._process.stdout.readline().split(b' ')
+            if len(header) != 3:
+                raise Exception(b'Cannot read object: ' + name)
+            _, objecttype, size = header
+            content = self._process.stdout.read(int(size))
+            # Content is followed by a newline.
+            self._process.stdout.read(1)
+        return objecttype, content
+
+
+_CAT_FILE_BATCH = _GitCatFileBatch()
+
+
+def git_cat_file(name):
+    """Returns a tuple of type and content of the git object.
+
+    Args:
+        name: object name, e.g. a hash, a ref or <commit>^{tree}.
+    """
+    return _CAT_FILE_BATCH.read(name)
+
+
 def _reverse(files):
     """Creates a reverse map from file path to file.
 
@@ -147,42 +201,39 @@ def gen_op(current_files, target_files):
 
 
 def git_mktree(files):
-    """Returns a git tree object hash after mktree recursively."""
+    """Returns a git tree object hash of files.
 
-    def recursive_default_dict():
-        return collections.defaultdict(recursive_default_dict)
+    The tree is built in a temporary index, by one `git update-index` and one
+    `git write-tree`, rather than by one `git mktree` per directory.
+    """
 
-    tree = recursive_default_dict()
+    paths = set()
+    directories = set()
     for f in files:
-        directories = f.path.split(b'/')
-        directories, filename = directories[:-1], directories[-1]
-        cwd = tree
-        for directory in directories:
-            # If cwd is a GitFile, which means a file and a directory shares the
-            # same name.
-            assert type(cwd) == collections.defaultdict
-            cwd = cwd[directory]
-        assert filename not in cwd
-        cwd[filename] = f
-
-    def _mktree(prefix, node):
-        objects = []
-        for name, val in node.items():
-            prefix.append(name)
-            if isinstance(val, collections.defaultdict):
-                tree_hash = _mktree(prefix, val)
-                objects.append(b'\t'.join(
-                    [b' '.join([b'040000', b'tree', tree_hash]), name]))
-            else:
-                path = b'/'.join(prefix)
-                assert path == val.path, '%s\n%s' % (str(path), str(val.path))
-                objects.append(b'\t'.join(
-                    [b' '.join([val.mode, b'blob', val.id]), name]))
-            prefix.pop(-1)
-        return subprocess.check_output(['git', 'mktree'],
-                                       input=b'\n'.join(objects)).strip(b'\n')
-
-    return _mktree([], tree)
+        assert f.path not in paths, f.path
+        paths.add(f.path)
+        directory = f.path
+        while b'/' in directory:
+            directory = directory.rsplit(b'/', 1)[0]
+            if directory in directories:
+                break
+            directories.add(directory)
+    # A file and a directory must not share the same name.
+    assert paths.isdisjoint(directories), paths.intersection(directories)
+
+    with tempfile.TemporaryDirectory() as index_dir:
+        env = dict(os.environ, GIT_INDEX_FILE=os.path.join(index_dir, 'index'))
+        # Entry looks like
+        # mode<space>id<tab>path<LF>
+        # Paths are kept C-quoted as `git ls-tree` printed them, which
+        # --index-info unquotes when -z is not given.
+        subprocess.run(['git', 'update-index', '--add', '--index-info'],
+                       input=b''.join(b'%s %s\t%s\n' % (f.mode, f.id, f.path)
+                                      for f in files),
+                       env=env,
+                       check=True)
+        return subprocess.check_output(['git', 'write-tree'],
+                                       env=env).strip(b'\n')
 
 
 def git_commit(tree, parents, message=b"", extra_env={}):
@@ -205,7 +256,7 @@ def git_commit(tree, parents, message=b"", extra_env={}):
 
 
 def git_revlist(from_commit, to_commit):
-    """Returns a list of commits and their parents.
+    """Returns a list of commits and their parents, oldest first.
 
     Each item in the list is a tuple, containing two elements.
     The first element is the commit hash; the second element is a list of parent
@@ -216,7 +267,8 @@ def git_revlist(from_commit, to_commit):
     ret = None
     if from_commit is None:
         ret = subprocess.check_output(['git', 'rev-list', to_commit,
-                                       '--topo-order', '--parents'])
+                                       '--topo-order', '--reverse',
+                                       '--parents'])
     else:
         # b'...'.join() later requires all variable to be binary-typed.
         if type(from_commit) == str:
@@ -225,14 +277,15 @@ def git_revlist(from_commit, to_commit):
             to_commit = to_commit.encode('ascii')
         commit_range = b'...'.join([from_commit, to_commit])
         ret = subprocess.check_output(['git', 'rev-list', commit_range,
-                                       '--topo-order', '--parents'])
+                                       '--topo-order', '--reverse',
+                                       '--parents'])
     ret = ret.split(b'\n')
     for line in ret:
         if not line:
             continue
         hashes = line.split(b' ')
         commits.append((hashes[0], hashes[1:]))
-    return list(reversed(commits))
+    return commits
 
 
 def git_blame(commit, filepath):